@@ -5,14 +5,18 @@ If no PCB files are found, then a patch is created from the
 submodule in this dir. 
 """
 # Standard libs
+import concurrent.futures
+import copy
+import functools
+import multiprocessing
 import os
-import tempfile
 import json
 import shutil
-import sys
-from typing import Any, Optional
+import types
+from typing import Optional
 
 # Extended libs
+import numpy as np
 import pcbnew
 from gerber2ems.simulation import Simulation
 from gerber2ems.postprocess import Postprocesor
@@ -25,6 +29,272 @@ from patch_antenna_calculator.patch_antenna_calculator import (
     patch_antenna,
 )
 
+# KiCAD internal units are nanometers
+_IU_PER_MM = 1e6
+
+# Output locations, all relative to this file
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_PCB_DIR = _HERE + "/kicad/"
+_KICAD_OUT = _PCB_DIR + "patch_antenna.kicad_pcb"
+_FAB_DIR = _HERE + "/fab"
+_EMS_DIR = _HERE + "/ems/"
+
+# Arguments for gerber2ems, normally given on its command line
+_GERBER2EMS_ARGS = types.SimpleNamespace(debug=False, export_field=True)
+
+# gerber2ems config attributes that main() sets after creating the 
+# config, and that simulation workers need to restore
+_WORKER_CONFIG_ATTRS = (
+    "base_dir",
+    "geometry_dir",
+    "simulation_dir",
+    "results_dir",
+    "fab_dir",
+    "pcb_width",
+    "pcb_height",
+)
+
+# Each openEMS process needs a lot of memory, so limit how many 
+# excitations are simulated at the same time
+_MAX_SIMULATION_WORKERS = 4
+
+# Width of the board outline
+_OUTLINE_WIDTH = pcbnew.FromMM(0.1)
+
+# Corners of the ground plane, relative to the center of the board
+_GROUND_PLANE_SIGNS = np.array([
+    (+1, +1),
+    (+1, -1),
+    (-1, -1),
+    (-1, +1),
+], dtype=np.int8)
+
+# Vertices of the inset patch, relative to the center of the board. 
+# The signs give the quadrant of each vertex, and the magnitude index 
+# picks either the patch (0) or the inset feed clearance (1) dimension. 
+_PATCH_SIGNS = np.array([
+    # Start in top left corner
+    (-1, -1),
+    # Go down
+    (-1, +1),
+    # Go in towards feedline, but stop before feedline width/2 + spacing
+    (-1, +1),
+    # Go up to create the left side of the inset feed clearance
+    (-1, +1),
+    # Go to the right, and create the clearance
+    (+1, +1),
+    # Go down to the corner of the right side of the inset line
+    (+1, +1),
+    # Now go to the bottom right corner of the patch
+    (+1, +1),
+    # Go up to the top right corner, the chain is closed from here
+    (+1, -1),
+], dtype=np.int8)
+_PATCH_MAGNITUDE_INDEX = np.array([
+    (0, 0),
+    (0, 0),
+    (1, 0),
+    (1, 1),
+    (1, 1),
+    (1, 0),
+    (0, 0),
+    (0, 0),
+])
+
+def _vnm(x_mm, y_mm, _vec=pcbnew.VECTOR2I):
+    """
+    Function to create a vector from coordinates in mm. 
+    Same as pcbnew.VECTOR2I_MM, including FromMM's truncation towards 
+    zero, but the conversion to internal units is done in Python 
+    rather than through two FromMM calls. 
+
+    :param x_mm: <float> X coordinate in mm
+    :param y_mm: <float> Y coordinate in mm
+    :return: <pcbnew.VECTOR2I> Vector in internal units
+    """
+    return _vec(int(x_mm * _IU_PER_MM), int(y_mm * _IU_PER_MM))
+
+def _line_chain(coords_mm):
+    """
+    Function to create a closed line chain from a set of points. 
+    The points are converted to internal units in one go, so that 
+    only the Append calls cross into pcbnew. Like FromMM, the 
+    conversion truncates towards zero. 
+
+    :param coords_mm: <array like> (N, 2) x and y coordinates in mm
+    :return: <pcbnew.SHAPE_LINE_CHAIN> Closed line chain through the points
+    """
+    coords_iu = (
+        np.asarray(coords_mm, dtype=np.float64) * _IU_PER_MM
+    ).astype(np.int64)
+    chain = pcbnew.SHAPE_LINE_CHAIN()
+    append = chain.Append
+    # tolist() gives plain Python ints, which SWIG accepts directly
+    for (x,y) in coords_iu.tolist():
+        append(x, y)
+    chain.SetClosed(True)
+    return chain
+
+def _add_rect(
+    pcb, layer, x0, y0, x1, y1, *, filled, width=None, net=None,
+    _shape=pcbnew.PCB_SHAPE, _rect=pcbnew.SHAPE_T_RECT, _vec=_vnm,
+):
+    """
+    Function to add a rectangle to a board. 
+    The pcbnew names are bound as default arguments so that the 
+    lookups are done once, rather than on every call. 
+
+    :param pcb: <pcbnew board object> KiCAD PCB board object
+    :param layer: <int> KiCAD layer to put the rectangle on
+    :param x0: <float> X coordinate of the start corner in mm
+    :param y0: <float> Y coordinate of the start corner in mm
+    :param x1: <float> X coordinate of the end corner in mm
+    :param y1: <float> Y coordinate of the end corner in mm
+    :param filled: <bool> Whether the rectangle is filled
+    :param width: <int> Line width in internal units, None for default
+    :param net: <pcbnew.NETINFO_ITEM> Net of the rectangle, None for no net
+    :return: <pcbnew.PCB_SHAPE> The added rectangle
+    """
+    # The position of a rectangle is given by its corners, 
+    # so there is no need to set it separately. 
+    rect = _shape(pcb)
+    rect.SetShape(_rect)
+    rect.SetFilled(filled)
+    rect.SetStart(_vec(x0, y0))
+    rect.SetEnd(_vec(x1, y1))
+    rect.SetLayer(layer)
+    if width is not None:
+        rect.SetWidth(width)
+    if net is not None:
+        rect.SetNet(net)
+    pcb.Add(rect)
+    return rect
+
+def _board_geometry(antenna, center_x_mm, center_y_mm):
+    """
+    Function to calculate the board geometry for an antenna. 
+    All coordinates are in mm. Rectangles are given as 
+    (x0, y0, x1, y1), polygons as (N, 2) coordinates. 
+
+    :param antenna: <patch_antenna_calculator.patch_antenna> Calculated patch antenna
+    :param center_x_mm: <int> X coordinate for center of board in mm 
+    :param center_y_mm: <int> Y coordinate for center of board in mm 
+    :return: <dict> The shapes making up the board
+    """
+    # Half dimensions are used for most corners, so compute them once
+    hw = antenna.w*0.5
+    hl = antenna.l*0.5
+    gpw2 = antenna.ground_plane_width*0.5
+    gpl2 = antenna.ground_plane_length*0.5
+    flw = antenna.feed_line_w
+    flw2 = flw*0.5
+    fl_l = antenna.feed_line_l
+    # Half width of the inset, i.e. feedline plus clearance
+    inset = flw2 + antenna.feed_line_clearance
+    edge_cut_offset_mm = 2
+    mask_margin_mm = 1
+
+    # The calculated width is the side where the feed line enters. 
+    # If we then have the feed line on the bottom, length = Y, Width = X 
+    # Create a board outline, based on the patch_antenna.ground_plane_[length/width]
+    outline = (
+        center_x_mm - gpw2 - edge_cut_offset_mm,
+        center_y_mm - gpl2 - edge_cut_offset_mm,
+        center_x_mm + gpw2 + edge_cut_offset_mm,
+        center_y_mm + gpl2 + edge_cut_offset_mm,
+    )
+
+    # Ground plane on the bottom, added as a zone
+    ground_plane = _GROUND_PLANE_SIGNS * (gpw2, gpl2) + (center_x_mm, center_y_mm)
+
+    # Create the patch on the top. 
+    # This is a rectangular patch with inset. The outline is built 
+    # from the vertex tables, picking the patch or inset magnitudes 
+    # for each vertex and applying the sign. 
+    magnitudes = np.array([
+        # Patch corners
+        (hw, hl),
+        # Inset feed clearance
+        (inset, hl - fl_l),
+    ])
+    offsets = _PATCH_SIGNS * np.column_stack((
+        magnitudes[_PATCH_MAGNITUDE_INDEX[:, 0], 0],
+        magnitudes[_PATCH_MAGNITUDE_INDEX[:, 1], 1],
+    ))
+    patch = offsets + (center_x_mm, center_y_mm)
+
+    # Add mask cutout for patch as well
+    patch_mask = (
+        center_x_mm - hw - mask_margin_mm,
+        center_y_mm - hl - mask_margin_mm,
+        center_x_mm + hw + mask_margin_mm,
+        center_y_mm + hl + mask_margin_mm,
+    )
+
+    # Add inset feed line. 
+    # Calculate the start of the feedline, which is the bottom of the 
+    # outline
+    # Feed line also has got to account for the top layer clearance:
+    top_layer_patch_clearance_y_mm = gpl2 - hl
+    feedline_start_y = center_y_mm + gpl2
+    # The x start coordinate of the feedline is the middle of the 
+    # board, minus half the width of the feedline. 
+    feedline_start_x = center_x_mm - flw2
+    feedline = (
+        feedline_start_x,
+        feedline_start_y,
+        feedline_start_x + flw,
+        feedline_start_y - fl_l - top_layer_patch_clearance_y_mm,
+    )
+
+    # And finally, the mask cutout for the feedline:
+    feedline_mask = (
+        feedline_start_x - mask_margin_mm,
+        feedline_start_y,
+        feedline_start_x + flw + mask_margin_mm,
+        feedline_start_y - fl_l,
+    )
+
+    return {
+        # NOTE: for gerber2ems, the origin should always be the bottom left corner. 
+        "aux_origin": (outline[0], outline[3]),
+        "outline": outline,
+        "ground_plane": ground_plane,
+        "patch": patch,
+        "patch_mask": patch_mask,
+        "feedline": feedline,
+        "feedline_mask": feedline_mask,
+        # Simulation port at the end of the feedline
+        "port": (center_x_mm, feedline_start_y),
+    }
+
+@functools.lru_cache(maxsize=128)
+def calculate_antenna(e_r, height_mm, cu_thickness_um, frequency_hz):
+    """
+    Function to calculate the patch antenna for a substrate and 
+    frequency. Results are cached, so that sweeps revisiting the 
+    same parameters don't redo the calculation. 
+    NOTE: the returned antenna is shared between callers, and 
+    must not be modified. 
+
+    :param e_r: <float> Dielectric constant of the substrate
+    :param height_mm: <float> Dielectric thickness in mm
+    :param cu_thickness_um: <float> Copper thickness in um
+    :param frequency_hz: <float> Center frequency in Hz
+    :return: <patch_antenna_calculator.patch_antenna> Calculated patch antenna
+    """
+    s = substrate(
+        e_r = e_r,
+        height_mm = height_mm,
+        cu_thickness_um = cu_thickness_um,
+    )
+    antenna = patch_antenna(
+        substrate = s, 
+        frequency_hz = frequency_hz,
+    )
+    antenna.calculate_antenna_params()
+    return antenna
+
 def create_kicad_board(antenna, pcb, center_x_mm, center_y_mm):
     """
     Function to transfer the antenna parameters to 
@@ -36,74 +306,25 @@ def create_kicad_board(antenna, pcb, center_x_mm, center_y_mm):
     :param center_y_mm: <int> Y coordinate for center of board in mm 
     :return: <pcbnew board object> Resulting PCB object.
     """
+    V = _vnm
+    geometry = _board_geometry(antenna, center_x_mm, center_y_mm)
+
     # Set the drill origin:
     design_settings = pcb.GetDesignSettings()
-    edge_cut_offset_mm = 2
-    # NOTE: for gerber2ems, the origin should always be the bottom left corner. 
-    design_settings.SetAuxOrigin(
-        pcbnew.VECTOR2I_MM(
-            center_x_mm - antenna.ground_plane_width/2 - edge_cut_offset_mm, 
-            center_y_mm + antenna.ground_plane_length/2 + edge_cut_offset_mm
-        )
-    )
+    design_settings.SetAuxOrigin(V(*geometry["aux_origin"]))
     pcb.StyleFromSettings(design_settings)
     # Create two new nets:
     gnd_net = pcbnew.NETINFO_ITEM(pcb, "GND")
     antenna_net = pcbnew.NETINFO_ITEM(pcb, "ant")
-    # The calculated width is the side where the feed line enters. 
-    # If we then have the feed line on the bottom, length = Y, Width = X 
-    # Create a board outline, based on the patch_antenna.ground_plane_[length/width]
-    outline = pcbnew.PCB_SHAPE(pcb)
-    outline.SetShape(pcbnew.SHAPE_T_RECT)
-    outline.SetFilled(False)
-    outline.SetPosition(pcbnew.VECTOR2I_MM(center_x_mm, center_y_mm))
-    outline.SetStart(
-        pcbnew.VECTOR2I_MM(
-            center_x_mm - antenna.ground_plane_width/2 -edge_cut_offset_mm, 
-            center_y_mm - antenna.ground_plane_length/2 -edge_cut_offset_mm,
-        )
-    )
-    outline.SetEnd(
-        pcbnew.VECTOR2I_MM(
-            center_x_mm + antenna.ground_plane_width/2+edge_cut_offset_mm, 
-            center_y_mm + antenna.ground_plane_length/2+edge_cut_offset_mm,
-        )
+    # Board outline
+    _add_rect(
+        pcb, pcbnew.Edge_Cuts, *geometry["outline"],
+        filled = False,
+        width = _OUTLINE_WIDTH,
     )
-    outline.SetLayer(pcbnew.Edge_Cuts)
-    outline.SetWidth(pcbnew.FromMM(0.1))
-    pcb.Add(outline)
 
     # Test: add ground plane as zone:
-    pts = [
-        # Start in top left corner
-        (
-            center_x_mm + antenna.ground_plane_width/2, 
-            center_y_mm + antenna.ground_plane_length/2
-        ),
-        (
-            center_x_mm + antenna.ground_plane_width/2, 
-            center_y_mm - antenna.ground_plane_length/2
-        ),
-        (
-            center_x_mm - antenna.ground_plane_width/2, 
-            center_y_mm - antenna.ground_plane_length/2
-        ),
-        (
-            center_x_mm - antenna.ground_plane_width/2, 
-            center_y_mm + antenna.ground_plane_length/2
-        ),
-        (
-            center_x_mm + antenna.ground_plane_width/2, 
-            center_y_mm + antenna.ground_plane_length/2
-        ),
-
-    ]
-    # Convert points from floats to vectors
-    pts = [pcbnew.VECTOR2I_MM(x,y) for (x,y) in pts]
-    chain = pcbnew.SHAPE_LINE_CHAIN()
-    for (x,y) in pts:
-        chain.Append(x, y)
-    chain.SetClosed(True)
+    chain = _line_chain(geometry["ground_plane"])
     gnd_plane = pcbnew.ZONE(pcb)
     gnd_plane.SetLayer(pcbnew.B_Cu)
     gnd_plane.AddPolygon( chain)
@@ -111,66 +332,9 @@ def create_kicad_board(antenna, pcb, center_x_mm, center_y_mm):
     gnd_plane.SetNet(gnd_net)
     pcb.Add(gnd_plane)
     
-    if False:
-        # Add the ground plane on the secondary side:
-        gnd_plane = pcbnew.PCB_SHAPE(pcb)
-        gnd_plane.SetShape(pcbnew.SHAPE_T_RECT)
-        gnd_plane.SetFilled(True)
-        gnd_plane.SetPosition(pcbnew.VECTOR2I_MM(center_x_mm, center_y_mm))
-        gnd_plane.SetStart(
-            pcbnew.VECTOR2I_MM(
-                center_x_mm - antenna.ground_plane_width/2, 
-                center_y_mm - antenna.ground_plane_length/2,
-            )
-        )
-        gnd_plane.SetEnd(
-            pcbnew.VECTOR2I_MM(
-                center_x_mm + antenna.ground_plane_width/2, 
-                center_y_mm + antenna.ground_plane_length/2,
-            )
-        )
-        gnd_plane.SetLayer(pcbnew.B_Cu)
-        # Set netclass:
-        gnd_plane.SetNet(gnd_net)
-        pcb.Add(gnd_plane)
-
     # Create the patch on the top. 
-    # This is a rectangular patch with inset. 
-    # points(x,y) of the patch
-
-    pts = [
-        # Start in top left corner
-        (center_x_mm - antenna.w/2, center_y_mm - antenna.l/2),
-        # Go down
-        (center_x_mm - antenna.w/2, center_y_mm + antenna.l/2),
-        # Go in towards feedline, but stop before feedline width/2 + spacing
-        (center_x_mm - antenna.feed_line_w/2 - antenna.feed_line_clearance, 
-            center_y_mm + antenna.l/2),
-        # Go up to create the left side of the inset feed clearance:
-        (center_x_mm - antenna.feed_line_w/2 - antenna.feed_line_clearance, 
-            center_y_mm + antenna.l/2 - antenna.feed_line_l),
-        # Go to the right, and create the clearance
-        (center_x_mm + antenna.feed_line_w/2 + antenna.feed_line_clearance, 
-            center_y_mm + antenna.l/2 - antenna.feed_line_l),
-        # Go down to the corner of the right side of the inset line
-        (center_x_mm + antenna.feed_line_w/2 + antenna.feed_line_clearance, 
-            center_y_mm + antenna.l/2),
-        # Now go to the bottom right corner of the patch
-        (center_x_mm + antenna.w/2, center_y_mm + antenna.l/2),
-        # Go up to the top right corner
-        (center_x_mm + antenna.w/2, center_y_mm - antenna.l/2),
-        # And finish at the starting point
-        (center_x_mm - antenna.w/2, center_y_mm - antenna.l/2),
-    ]
-    # Convert points from floats to vectors
-    pts = [pcbnew.VECTOR2I_MM(x,y) for (x,y) in pts]
-
     sps = pcbnew.SHAPE_POLY_SET()
-    chain = pcbnew.SHAPE_LINE_CHAIN()
-    for (x,y) in pts:
-        chain.Append(x, y)
-    chain.SetClosed(True)
-    sps.AddOutline(chain)
+    sps.AddOutline(_line_chain(geometry["patch"]))
 
     ps = pcbnew.PCB_SHAPE(pcb, pcbnew.SHAPE_T_POLY)
     ps.SetLayer(pcbnew.F_Cu)
@@ -179,115 +343,60 @@ def create_kicad_board(antenna, pcb, center_x_mm, center_y_mm):
 
     pcb.Add(ps)
 
-    # Add mask cutout for patch as well
-    mask_margin_mm = 1
-    patch_mask = pcbnew.PCB_SHAPE(pcb)
-    patch_mask.SetShape(pcbnew.SHAPE_T_RECT)
-    patch_mask.SetFilled(True)
-    patch_mask.SetPosition(pcbnew.VECTOR2I_MM(center_x_mm, center_y_mm))
-    patch_mask.SetStart(
-        pcbnew.VECTOR2I_MM(
-            center_x_mm - antenna.w/2 - mask_margin_mm, 
-            center_y_mm - antenna.l/2 - mask_margin_mm,
-        )
-    )
-    patch_mask.SetEnd(
-        pcbnew.VECTOR2I_MM(
-            center_x_mm + antenna.w/2 + mask_margin_mm, 
-            center_y_mm + antenna.l/2 + mask_margin_mm,
-        )
-    )
-    patch_mask.SetLayer(pcbnew.F_Mask)
-    pcb.Add(patch_mask)
-
-    # Add inset feed line. 
-    # Calculate the start of the feedline, which is the bottom of the 
-    # outline
-    # Feed line also has got to account for the top layer clearance:
-    top_layer_patch_clearance_y_mm = (antenna.ground_plane_length - antenna.l)/2
-    feedline_start_y = center_y_mm + antenna.ground_plane_length/2
-    # The x start coordinate of the feedline is the middle of the 
-    # board, minus half the width of the feedline. 
-    feedline_start_x = center_x_mm - antenna.feed_line_w/2
-    
-    # Add the feedline
-    feedline = pcbnew.PCB_SHAPE(pcb)
-    feedline.SetShape(pcbnew.SHAPE_T_RECT)
-    feedline.SetFilled(True)
-    feedline.SetPosition(pcbnew.VECTOR2I_MM(center_x_mm, center_y_mm))
-    feedline.SetStart(
-        pcbnew.VECTOR2I_MM(
-            feedline_start_x, 
-            feedline_start_y,
-        )
-    )
-    feedline.SetEnd(
-        pcbnew.VECTOR2I_MM(
-            feedline_start_x + antenna.feed_line_w, 
-            feedline_start_y - antenna.feed_line_l - top_layer_patch_clearance_y_mm,
-        )
-    )
-    feedline.SetLayer(pcbnew.F_Cu)
-    pcb.Add(feedline)
-
-    # And finally, the mask cutout for the feedline:
-    feedline_mask = pcbnew.PCB_SHAPE(pcb)
-    feedline_mask.SetShape(pcbnew.SHAPE_T_RECT)
-    feedline_mask.SetFilled(True)
-    feedline_mask.SetPosition(pcbnew.VECTOR2I_MM(center_x_mm, center_y_mm))
-    feedline_mask.SetStart(
-        pcbnew.VECTOR2I_MM(
-            feedline_start_x - mask_margin_mm, 
-            feedline_start_y,
-        )
-    )
-    feedline_mask.SetEnd(
-        pcbnew.VECTOR2I_MM(
-            feedline_start_x + antenna.feed_line_w + mask_margin_mm, 
-            feedline_start_y - antenna.feed_line_l,
-        )
-    )
-    feedline_mask.SetLayer(pcbnew.F_Mask)
-    pcb.Add(feedline_mask)
+    # Mask cutout for the patch, the feedline and its mask cutout
+    _add_rect(pcb, pcbnew.F_Mask, *geometry["patch_mask"], filled = True)
+    _add_rect(pcb, pcbnew.F_Cu, *geometry["feedline"], filled = True)
+    _add_rect(pcb, pcbnew.F_Mask, *geometry["feedline_mask"], filled = True)
 
     # Add the simulation port
     footprint = pcbnew.FOOTPRINT(pcb)
     footprint.SetReference("SP1")   # Simulation ports must be SP_xxx
-    # Set the reference to the end of the feedline
-    sp1_y = feedline_start_y
-    sp1_x = center_x_mm
     # Set the reference (silk layer) relative to the footprint
-    footprint.Reference().SetPos(pcbnew.VECTOR2I_MM(0,-2))
+    footprint.Reference().SetPos(V(0,-2))
     footprint.SetExcludedFromPosFiles(False)
     footprint.SetValue("Simulation_Port")
     pcb.Add(footprint)# add it to our pcb
-    mod_pos = pcbnew.VECTOR2I_MM(sp1_x,sp1_y)
+    # Set the reference to the end of the feedline
+    mod_pos = V(*geometry["port"])
     footprint.SetPosition(mod_pos)
 
-    
+@functools.lru_cache(maxsize=8)
+def _load_json_cached(path, mtime):
+    """
+    Function to load a JSON file. The modification time is part 
+    of the cache key, so that edits to the file are picked up. 
+    NOTE: the returned object is shared between callers. 
 
+    :param path: <str> Path to the JSON file
+    :param mtime: <float> Modification time of the file
+    :return: <dict> Decoded JSON
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
 
+def _load_json(path):
+    """
+    Function to load a JSON file, reusing the decoded result 
+    as long as the file is unchanged. 
 
-def fromUTF8Text( afilename ):
-    if sys.version_info < (3, 0):
-        return afilename.encode()
-    else:
-        return afilename
+    :param path: <str> Path to the JSON file
+    :return: <dict> Decoded JSON
+    """
+    return _load_json_cached(path, os.path.getmtime(path))
 
-def export_gerbers(kicad_pcb_filename, output_dir, stackup_filename, project_name):
+def export_gerbers(pcb, output_dir, stackup_filename, project_name):
     """
     Function to export gerber files from KiCAD pcbNew board.
+    NOTE: in order to get the naming convention correct, the board 
+    must have been loaded from its file with pcbnew.LoadBoard. 
     
     :param pcb: <pcbnew.BOARD> Board object to be exported
     :param output_dir: <str> String pointing to where the files should be exported. 
     """
-    # In order to get the naming convention correct, we need to open 
-    # the board from source:
-    pcb = pcbnew.LoadBoard(kicad_pcb_filename)
     filler = pcbnew.ZONE_FILLER(pcb)
     filler.Fill(pcb.Zones())
     pcbnew.SaveBoard(
-        aFileName = kicad_pcb_filename, 
+        aFileName = pcb.GetFileName(), 
         aBoard = pcb,
     )
     # Create the plot controller object based of the pcb, and get the plot options
@@ -320,28 +429,31 @@ def export_gerbers(kicad_pcb_filename, output_dir, stackup_filename, project_nam
     
 
     # Create a plot plan, and export
-    with open(stackup_filename, "r", encoding="utf-8") as file:
-        try:
-            stackup_config = json.load(file)
-        except json.JSONDecodeError as error:
-            raise json.JSONDecodeError(f"JSON decoding of stackup failed at {error.lineno}:{error.colno}: {error.msg,}")
-
+    try:
+        stackup_config = _load_json(stackup_filename)
+    except json.JSONDecodeError as error:
+        raise json.JSONDecodeError(f"JSON decoding of stackup failed at {error.lineno}:{error.colno}: {error.msg,}")
+
+    # Fetch the KiCAD layer definitons, for the layers that define one. 
+    # NPTH pads are skipped for copper layers. 
+    layers_resolved = []
     for layer in stackup_config["layers"]:
-        # Fetch the KiCAD layer definiton, if the layer is defined
         if "kicad_layer" in layer:
             kicad_layer = getattr(pcbnew, layer["kicad_layer"])
-            if kicad_layer <= pcbnew.B_Cu:
-                plot_options.SetSkipPlotNPTH_Pads( True )
-            else:
-                plot_options.SetSkipPlotNPTH_Pads( False )
-            name_suffix = layer["name"]
-            plot_controller.SetLayer(kicad_layer)
-            plot_controller.OpenPlotfile(
-                name_suffix,
-                pcbnew.PLOT_FORMAT_GERBER,
+            layers_resolved.append(
+                (kicad_layer, layer["name"], kicad_layer <= pcbnew.B_Cu)
             )
-            plot_controller.PlotLayer()
-            #print( 'plot %s' % fromUTF8Text( plot_controller.GetPlotFileName() ) )
+    # Each layer is plotted to its own gerber file, so the layers can't 
+    # be batched into a single PlotLayers call. 
+    plot_format = pcbnew.PLOT_FORMAT_GERBER
+    for kicad_layer, name_suffix, skip_npth in layers_resolved:
+        plot_options.SetSkipPlotNPTH_Pads(skip_npth)
+        plot_controller.SetLayer(kicad_layer)
+        plot_controller.OpenPlotfile(
+            name_suffix,
+            plot_format,
+        )
+        plot_controller.PlotLayer()
 
     drlwriter = pcbnew.EXCELLON_WRITER(pcb)
     drlwriter.SetMapFileFormat(pcbnew.PLOT_FORMAT_PDF)
@@ -359,18 +471,18 @@ def export_gerbers(kicad_pcb_filename, output_dir, stackup_filename, project_nam
 
     genDrl = True
     genMap = True
-    #print( 'create drill and map files in %s' % fromUTF8Text( plot_controller.GetPlotFileName() ) )
     drlwriter.CreateDrillandMapFilesSet( plot_controller.GetPlotDirName(), genDrl, genMap )
 
 
     plot_controller.ClosePlot()
 
-def export_pos(kicad_pcb_filename, csv_filename):
+def export_pos(pcb, csv_filename):
     """
     Function to export the position file. 
+
+    :param pcb: <pcbnew.BOARD> Board object to be exported
+    :param csv_filename: <str> Path to the position file to write
     """
-    # Load the board from the filename
-    pcb = pcbnew.LoadBoard(kicad_pcb_filename)
     plot_exporter = pcbnew.PLACE_FILE_EXPORTER(
         aBoard = pcb, 
         aUnitsMM = True, # Use mm as units
@@ -387,17 +499,18 @@ def export_pos(kicad_pcb_filename, csv_filename):
     # GenPositionData gives the csv file as a string
     pos_data = plot_exporter.GenPositionData()
     # Condition the string to look more like a csv file.
-    pos_data = pos_data.splitlines()
+    lines = [
+        line.replace("\t", ",")
+        for line in pos_data.splitlines()
+        if not line.startswith("#")
+    ]
     with open(csv_filename, "w") as f:
-        for line in pos_data:
-            if line.startswith("#"):
-                continue
-            f.write(line.replace("\t", ",") + "\n")
+        f.write("\n".join(lines) + "\n" if lines else "")
     
 
 def create_dir(path: str, cleanup: bool = False) -> None:
     """
-    Creates a directory if it doesn't exist
+    Creates a directory, including any missing parents, if it doesn't exist
     WARNING: IF CLEANUP=TRUE THEN IT WILL DELETE
     THE BRANCHES OF PATH, SEE DOCUMENTATION 
     FOR shutil.rmtree BEFORE USING! 
@@ -405,85 +518,68 @@ def create_dir(path: str, cleanup: bool = False) -> None:
     :param path: <str> absolute path to dir
     :param cleanup: <bool> 
     """
-    directory_path = os.path.join(os.getcwd(), path)
-    if cleanup and os.path.exists(directory_path):
-        shutil.rmtree(directory_path)
-    if not os.path.exists(directory_path):
-        os.mkdir(directory_path)
+    if cleanup and os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path, exist_ok=True)
 
 
 def main():
 
-    # Define and calculate the substrate
-    s = substrate(
+    # Calculate the antenna dimensions
+    antenna = calculate_antenna(
         e_r = 4.6, # Dielectric constant
         height_mm = 1.6, # dielectric thickness in mm
         cu_thickness_um = 35, # Copper thickness in um
+        frequency_hz = 2.45e6,
     )
-    center_frequency = 2.45e6
 
-    # Calculate the antenna dimensions
-    antenna = patch_antenna(
-        substrate = s, 
-        frequency_hz = center_frequency,
-    )
-    antenna.calculate_antenna_params()
-
-    # Create an empty PCB
-    pcb = pcbnew.CreateEmptyBoard()
-    
     # Center coordinates
     center_x_mm = 100
     center_y_mm = 100
 
-    # Convert the antenna params to the PCB object
-    create_kicad_board(antenna, pcb, center_x_mm, center_y_mm)
-
     # Save the KiCAD board
-    pcb_dir = os.path.dirname(os.path.abspath(__file__)) + "/kicad/"
     # Create the dir if it doesn't exist:
-    if not os.path.exists(pcb_dir):
-        os.makedirs(pcb_dir)
-    kicad_pcb_filename = pcb_dir + "patch_antenna.kicad_pcb"
+    create_dir(_PCB_DIR)
+    kicad_pcb_filename = _KICAD_OUT
     print(f"Saving board to {kicad_pcb_filename}")
+    # Create an empty PCB and convert the antenna params to it
+    pcb = pcbnew.CreateEmptyBoard()
+    create_kicad_board(antenna, pcb, center_x_mm, center_y_mm)
     pcbnew.SaveBoard(
         aFileName = kicad_pcb_filename, 
         aBoard = pcb,
     )
 
     # Export the gerber:
-    gerber_dir = os.path.dirname(os.path.abspath(__file__)) + "/fab"
+    gerber_dir = _FAB_DIR
     # Create the dir if it doesn't exist:
-    if not os.path.exists(gerber_dir):
-        os.makedirs(gerber_dir)
+    create_dir(gerber_dir)
     stackup_file = gerber_dir + "/stackup.json"
-    export_gerbers(kicad_pcb_filename, gerber_dir, stackup_file, "patch_antenna")
+    # Load the board from source once, and share it between the exports. 
+    # This gets the naming convention of the exported files correct. 
+    pcb = pcbnew.LoadBoard(kicad_pcb_filename)
+    export_gerbers(pcb, gerber_dir, stackup_file, "patch_antenna")
     pos_filename = gerber_dir + "/patch_antenna-pos.csv"
-    export_pos(kicad_pcb_filename, pos_filename)
+    export_pos(pcb, pos_filename)
 
     # Open and parse the config:
     config_filename = gerber_dir + "/config.json"
-    with open(config_filename, "r", encoding="utf-8") as file:
-        try:
-            config = json.load(file)
-        except json.JSONDecodeError as error:
-            print(f"JSON decoding failed at {error.lineno}:{error.colno}: {error.msg,}")
-            return
+    try:
+        # Copy, as the cached config is modified below
+        config = copy.deepcopy(_load_json(config_filename))
+    except json.JSONDecodeError as error:
+        print(f"JSON decoding failed at {error.lineno}:{error.colno}: {error.msg,}")
+        return
         
     # Create the gerber2ems config based on the config read from the json file
     # Set the args parameter to None for now. 
     # Overload the port width with antenna parameters:
-        print(f"{config['ports']}")
+    print(f"{config['ports']}")
     config["ports"][0]["width"] = antenna.feed_line_w*1000
-    class dummyArgs:
-        pass
-    args_dummy = dummyArgs()
-    setattr(args_dummy, "debug", False)
-    setattr(args_dummy, "export_field", True)
-    gerber2ems_config = Config(config, args_dummy)
+    gerber2ems_config = Config(config, _GERBER2EMS_ARGS)
     # Overide the configs default directories:
     
-    ems_base_dir = os.path.dirname(os.path.abspath(__file__)) + "/ems/"
+    ems_base_dir = _EMS_DIR
     geometry_dir = ems_base_dir + "geometry/"
     sim_dir = ems_base_dir + "sim/"
     result_dir = ems_base_dir + "results/"
@@ -501,26 +597,27 @@ def main():
     
     importer.import_stackup()
     importer.process_gbrs_to_pngs()
-    print(f"{Config.get().layers=}")
+    cfg = Config.get()
+    print(f"{cfg.layers=}")
     # Getting the metals for the outline makes no sense. 
-    top_layer_name = Config.get().get_metals()[1].file
+    top_layer_name = cfg.get_metals()[1].file
     (width, height) = importer.get_dimensions(top_layer_name + ".png")
     print(f"{width=}, {height=}")
-    Config.get().pcb_height = height
-    Config.get().pcb_width = width
+    cfg.pcb_height = height
+    cfg.pcb_width = width
 
     sim.create_materials()
     sim.add_gerbers()
     sim.add_mesh()
     sim.add_substrates()
-    if Config.get().arguments.export_field:
+    if cfg.arguments.export_field:
         sim.add_dump_boxes()
     sim.set_boundary_conditions(pml=False)
     sim.add_vias()
     # Add the ports
     sim.ports = []
     importer.import_port_positions()
-    for index, port_config in enumerate(Config.get().ports):
+    for index, port_config in enumerate(cfg.ports):
         print(f"{index=}")
         print(f"{dir(port_config)=}")
         print(f"{port_config.dB_margin=}")
@@ -540,7 +637,7 @@ def main():
     
     # Start with a single thread. 
     # TODO: Get this from the config later on..
-    simulate(threads=8) 
+    simulate(config, threads=8) 
 
     print("Postprocessing")
     
@@ -554,26 +651,78 @@ def add_ports(sim: Simulation, excited_port_number: Optional[int] = None) -> Non
     sim.ports = []
     importer.import_port_positions()
 
-    for index, port_config in enumerate(Config.get().ports):
+    ports = Config.get().ports
+    for index, port_config in enumerate(ports):
         sim.add_msl_port(port_config, index, index == excited_port_number)
 
-def simulate(threads: None | int = None) -> None:
-    """Run the simulation."""
-    for index, port in enumerate(Config.get().ports):
-        if port.excite:
-            sim = Simulation()
-            importer.import_stackup()
-            sim.create_materials()
-            sim.set_excitation()
-            #logging.info("Simulating with excitation on port #%i", index)
-            sim.load_geometry()
-            add_ports(sim, index)
-            sim.run(index, threads=threads)
+def _simulate_port(index: int, threads: None | int = None) -> None:
+    """
+    Run the simulation with excitation on a single port. 
+    The stackup must already have been imported. 
+    """
+    sim = Simulation()
+    sim.create_materials()
+    sim.set_excitation()
+    #logging.info("Simulating with excitation on port #%i", index)
+    sim.load_geometry()
+    add_ports(sim, index)
+    sim.run(index, threads=threads)
+
+def _init_simulation_worker(config: dict, config_attrs: dict) -> None:
+    """
+    Set up a simulation worker process. 
+    Workers are spawned, so the gerber2ems config is rebuilt from the 
+    json config and the attributes that main() overrides. 
+    """
+    gerber2ems_config = Config(config, _GERBER2EMS_ARGS)
+    for name, value in config_attrs.items():
+        setattr(gerber2ems_config, name, value)
+    importer.import_stackup()
+
+def simulate(config: dict, threads: None | int = None) -> None:
+    """
+    Run the simulation. 
+    The excitations are independent, so when more than one port is 
+    excited, they are simulated in separate worker processes, sharing 
+    the threads between them. 
+
+    :param config: <dict> json config the gerber2ems config was created from
+    :param threads: <int> Total number of threads, None for all CPUs
+    """
+    cfg = Config.get()
+    excited = [index for index, port in enumerate(cfg.ports) if port.excite]
+    # The stackup is the same for all excitations, so it is imported 
+    # once per process that runs simulations. 
+    if len(excited) == 0:
+        return
+    if len(excited) == 1:
+        importer.import_stackup()
+        _simulate_port(excited[0], threads)
+        return
+
+    # Each worker imports the stackup once, in _init_simulation_worker
+    config_attrs = {name: getattr(cfg, name) for name in _WORKER_CONFIG_ATTRS}
+    workers = min(len(excited), _MAX_SIMULATION_WORKERS)
+    if threads is None:
+        threads = os.cpu_count() or 1
+    threads = max(1, threads // workers)
+    # Spawn rather than fork, as pcbnew has started threads by now
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_simulation_worker,
+        initargs=(config, config_attrs),
+    ) as executor:
+        futures = [executor.submit(_simulate_port, index, threads) for index in excited]
+        for future in concurrent.futures.as_completed(futures):
+            # Raise any errors from the workers
+            future.result()
 
 def add_virtual_ports(sim: Simulation) -> None:
     """Add virtual ports needed for data postprocessing due to openEMS api design."""
     print("Adding virtual ports")
-    for port_config in Config.get().ports:
+    ports = Config.get().ports
+    for port_config in ports:
         sim.add_virtual_port(port_config)
 
 def postprocess(sim: Simulation) -> None:
@@ -581,15 +730,18 @@ def postprocess(sim: Simulation) -> None:
     if len(sim.ports) == 0:
         add_virtual_ports(sim)
 
-    frequencies = np.linspace(Config.get().start_frequency, Config.get().stop_frequency, 1001)
-    post = Postprocesor(frequencies, len(Config.get().ports))
-    impedances = np.array([p.impedance for p in Config.get().ports])
+    cfg = Config.get()
+    ports = cfg.ports
+    nports = len(ports)
+    frequencies = np.linspace(cfg.start_frequency, cfg.stop_frequency, 1001)
+    post = Postprocesor(frequencies, nports)
+    impedances = np.fromiter((p.impedance for p in ports), dtype=np.float64, count=nports)
     post.add_impedances(impedances)
 
-    for index, port in enumerate(Config.get().ports):
+    for index, port in enumerate(ports):
         if port.excite:
             reflected, incident = sim.get_port_parameters(index, frequencies)
-            for i, _ in enumerate(Config.get().ports):
+            for i in range(nports):
                 post.add_port_data(i, index, incident[i], reflected[i])
 
     post.process_data()